@@ -2,15 +2,18 @@
 #                   CAKE DETECTOR 2                      #
 ##########################################################
 import numpy as np
-import matplotlib.pyplot as plt
 import cv2
 from cv2 import aruco
-import os
-import PIL
-from PIL import Image
 
-from skimage import color, measure, morphology, feature, filters
-import imutils
+# matplotlib n'est importé que par les méthodes de debug (plotFrame, ...)
+# pour garder un démarrage léger en production
+
+
+def rotate(image, angle):
+    """Rotation autour du centre sans changer la taille (comme imutils.rotate)"""
+    (h, w) = image.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h))
 
 
 class CakeDetector:
@@ -105,12 +108,11 @@ class CakeDetector:
                 grayFrame, corner, winSize=(3, 3), zeroZone=(-1, -1), criteria=criteria
             )
 
-        frame_markers = aruco.drawDetectedMarkers(frame.copy(), markerCorners, markerIds)
         """
+        frame_markers = aruco.drawDetectedMarkers(frame.copy(), markerCorners, markerIds)
         plt.figure(figsize=(20,20))
         plt.imshow(frame_markers)
         plt.show()"""
-        imaxis = aruco.drawDetectedMarkers(frame.copy(), markerCorners, markerIds)
         ar = np.array(markerCorners)
         # Corner extern of reference arucoTag
         a0 = ar[markerIds == 20, 0, 0]
@@ -337,6 +339,8 @@ class CakeDetector:
         return pos_center
 
     def determinNumberOfLayer(self):
+        import matplotlib.pyplot as plt
+
         wide = 100
         height = 100
         plt.figure(figsize=(10, 10))
@@ -366,8 +370,7 @@ class CakeDetector:
         bb_h = 100
         bb_w = 10
         offset_h = 60
-        frame = self.frame.copy()
-        frame = cv2.GaussianBlur(frame, (7, 7), 0)
+        frame = cv2.GaussianBlur(self.frame, (7, 7), 0)
         cakeColor = []
         j = -1
         pos = self.posCenter
@@ -401,7 +404,7 @@ class CakeDetector:
                 (3100 - self.posCenter[k, 1]), (pix_y) - self.posCenter[k, 2]
             )
             angle_deg = angle_rad * 180 / 3.14
-            markerBox = imutils.rotate(markerBox, angle=-90 + angle_deg)
+            markerBox = rotate(markerBox, angle=-90 + angle_deg)
             markerBox = markerBox[
                 squareBB + offset_h :, squareBB - bb_w : squareBB + bb_w, :
             ]
@@ -423,24 +426,18 @@ class CakeDetector:
             for i, c in enumerate(BB):
                 # input_mask = BB[c]
                 input_mask = c
-                # labels_mask = measure.label(input_mask[-int(bb_h*2/3):,:])
-                labels_mask = measure.label(input_mask)
-                regions = measure.regionprops(labels_mask)
-                regions.sort(key=lambda x: x.area, reverse=True)
-                if len(regions) > 1:
-                    for rg in regions[1:]:
-                        labels_mask[rg.coords[:, 0], rg.coords[:, 1]] = 0
-                labels_mask[labels_mask != 0] = 1
-                BB[i] = labels_mask
-
-                region = measure.regionprops(labels_mask)
-                if region:
-                    minr, minc, maxr, maxc = region[0].bbox
-                    width = maxc - minc
+                # Garde uniquement la plus grande région (connexité 8)
+                n, labels_mask, stats, centroids = cv2.connectedComponentsWithStats(
+                    input_mask, connectivity=8
+                )
+                if n > 1:
+                    largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+                    BB[i] = (labels_mask == largest).astype(np.uint8)
+                    width = stats[largest, cv2.CC_STAT_WIDTH]
                     if width >= 10:
-                        heightLayer = maxr - minr
+                        heightLayer = stats[largest, cv2.CC_STAT_HEIGHT]
                         height += heightLayer
-                        cakeSort.append([color_map[i], region[0].centroid[0]])
+                        cakeSort.append([color_map[i], centroids[largest, 1]])
             cakeSort.sort(key=lambda a: a[1])
 
             try:
@@ -484,6 +481,8 @@ class CakeDetector:
         # print(cakeColor)
 
     def plotFrame(self):
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(20, 20))
         plt.imshow(self.frame)
         TagId = [13, 36, 47]
@@ -0,0 +1,117 @@
+##########################################################
+#                   DEBUG RENDERER                       #
+##########################################################
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from cakeDetector import cakeDetector as cd
+
+logger = logging.getLogger(__name__)
+
+
+class DebugRenderer:
+    """
+    Draw detection overlays in a background thread and publish JPEG snapshots
+
+    submit() is called from the detection loop with the camera frame and
+    the detected cakes: it only keeps a reference to the latest ones, at
+    most once per period. Warping, drawing and encoding are done by the
+    renderer thread.
+
+    Attributes
+    ----------
+    period : float
+        minimum time between two snapshots in seconds
+    path : str
+        file where the last snapshot is written, optional
+    scale : float
+        factor for resize snapshot
+    jpeg : bytes
+        last snapshot encoded in JPEG
+
+    Methods
+    -------
+    submit(frame, cakes, warpMatrix)
+        give a frame to render, never blocks
+    close()
+        stop the renderer thread
+    """
+
+    # Couleur (BGR) de la couche du dessus : 0 brun, 1 jaune, 2 rose
+    LayerColor = {0: (35, 45, 70), 1: (20, 185, 235), 2: (165, 60, 235)}
+
+    def __init__(self, period=1.0, path=None, scale=0.25, quality=80):
+        self.period = period
+        self.path = path
+        self.scale = scale
+        self.quality = quality
+        self.jpeg = None
+        self._lastSubmit = 0.0
+        self._pending = None
+        self._event = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, cakes, warpMatrix):
+        now = time.monotonic()
+        if now - self._lastSubmit < self.period:
+            return
+        self._lastSubmit = now
+        self._pending = (frame, cakes, warpMatrix)
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            if not self._running:
+                break
+            pending, self._pending = self._pending, None
+            if pending is None:
+                continue
+            try:
+                self._publish(self.render(*pending))
+            except Exception as e:
+                logger.error(f"Debug renderer error : {e}")
+
+    def render(self, frame, cakes, warpMatrix):
+        """Redresser la frame caméra (BGR) et dessiner les gâteaux détectés"""
+        f = self.scale
+        size = (
+            round((2000 + cd.CakeDetector.offset_y) * cd.CakeDetector.f * f),
+            round((3000 + cd.CakeDetector.offset_x) * cd.CakeDetector.f * f),
+        )
+        M = np.diag([f, f, 1.0]) @ np.asarray(warpMatrix, dtype=np.float64)
+        image = cv2.warpPerspective(frame[:, :, :3], M, size)
+        for cake in cakes:
+            # x = ligne, y = colonne de la frame redressée
+            center = (int(cake["y"] * f), int(cake["x"] * f))
+            layers = cake.get("layers") or [None]
+            color = self.LayerColor.get(layers[0], (0, 255, 0))
+            cv2.circle(image, center, max(int(60 * f), 3), color, 2)
+            cv2.drawMarker(image, center, (0, 255, 0), cv2.MARKER_CROSS, 12, 2)
+        return image
+
+    def _publish(self, image):
+        ok, buffer = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        )
+        if not ok:
+            return
+        self.jpeg = buffer.tobytes()
+        if self.path:
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(self.jpeg)
+            os.replace(tmp, self.path)
+
+    def close(self):
+        self._running = False
+        self._event.set()
+        self._thread.join()
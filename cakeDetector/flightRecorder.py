@@ -0,0 +1,308 @@
+##########################################################
+#                   FLIGHT RECORDER                      #
+##########################################################
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from cakeDetector import cakeDetector as cd
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PICAMFR2"
+HEADER_SIZE = 4096
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("nbSlots", "<u8"),
+        ("frameShape", "<u4", (3,)),
+        ("sourceShape", "<u4", (3,)),
+        ("maxPayload", "<u4"),
+        ("head", "<u8"),
+    ]
+)
+
+
+def _recordDtype(frameShape, maxPayload):
+    return np.dtype(
+        [
+            ("seq", "<u8"),
+            ("timestamp", "<f8"),
+            ("monotonic", "<f8"),
+            ("valid", "u1"),
+            ("warpMatrix", "<f8", (3, 3)),
+            ("payloadSize", "<u4"),
+            ("payload", "u1", (maxPayload,)),
+            ("frame", "u1", tuple(frameShape)),
+        ]
+    )
+
+
+def _jsonDefault(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+
+class FlightRecorder:
+    """
+    Record downscaled frames, calibration and detections in a ring file
+
+    The file is memory-mapped and has a fixed size: once nbSlots records
+    are written the oldest ones are overwritten. Downscaling, encoding and
+    writing happen in a background thread, record() only queues the frame.
+
+    An existing file with the same layout is reopened and recording goes on
+    after its last record, so a client restart keeps the match. A file with
+    another layout is renamed with a date suffix.
+
+    Frames are kept at full resolution by default. With scale < 1 the
+    ArUco tags may become too small and a replay will not give the same
+    detections as the live run.
+
+    Attributes
+    ----------
+    path : str
+        path of the ring file
+    nbSlots : int
+        number of records kept in the file
+    frameShape : tuple
+        shape of the stored (downscaled) frames
+    sourceShape : tuple
+        shape of the frames given to record()
+    dropped : int
+        number of records dropped because the writer was late
+
+    Methods
+    -------
+    record(frame, detections, warpMatrix, timestamp)
+        queue a record, never blocks
+    close()
+        write pending records and close the file
+    """
+
+    def __init__(self, path, sourceShape, scale=1.0, nbSlots=300, maxPayload=4096, queueSize=8):
+        sourceShape = tuple(sourceShape)
+        if len(sourceShape) == 2:
+            sourceShape += (1,)
+        self.path = path
+        self.nbSlots = nbSlots
+        self.sourceShape = sourceShape
+        self.frameShape = (
+            max(1, round(sourceShape[0] * scale)),
+            max(1, round(sourceShape[1] * scale)),
+            sourceShape[2],
+        )
+        self.maxPayload = maxPayload
+        self.dropped = 0
+
+        dtype = _recordDtype(self.frameShape, maxPayload)
+        size = HEADER_SIZE + dtype.itemsize * nbSlots
+        reopen = self._sameLayout(size)
+        if not reopen:
+            if os.path.exists(path):
+                rotated = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}"
+                os.replace(path, rotated)
+                logger.warning(f"{path} has another layout, moved to {rotated}")
+            with open(path, "wb") as f:
+                f.truncate(size)
+        self._header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self._records = np.memmap(
+            path, dtype=dtype, mode="r+", offset=HEADER_SIZE, shape=(nbSlots,)
+        )
+        if reopen:
+            valid = self._records["valid"] == 1
+            self._seq = int(self._records["seq"][valid].max()) + 1 if valid.any() else 0
+        else:
+            self._header["magic"] = MAGIC
+            self._header["nbSlots"] = nbSlots
+            self._header["frameShape"] = self.frameShape
+            self._header["sourceShape"] = self.sourceShape
+            self._header["maxPayload"] = maxPayload
+            self._header["head"] = 0
+            self._seq = 0
+
+        self._queue = queue.Queue(maxsize=queueSize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _sameLayout(self, size):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) != size:
+            return False
+        header = np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)[0]
+        return (
+            header["magic"] == MAGIC
+            and int(header["nbSlots"]) == self.nbSlots
+            and tuple(header["frameShape"]) == self.frameShape
+            and tuple(header["sourceShape"]) == self.sourceShape
+            and int(header["maxPayload"]) == self.maxPayload
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, frame, detections=None, warpMatrix=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self._queue.put_nowait(
+                (timestamp, time.monotonic(), frame, detections, warpMatrix)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error(f"Flight recorder error : {e}")
+
+    def _write(self, timestamp, monotonic, frame, detections, warpMatrix):
+        payload = json.dumps(detections, default=_jsonDefault).encode()
+        if len(payload) > self.maxPayload:
+            payload = json.dumps({"truncated": len(payload)}).encode()
+
+        h, w, c = self.frameShape
+        small = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+
+        head = int(self._header["head"][0])
+        slot = head % self.nbSlots
+        rec = self._records
+        rec["valid"][slot] = 0
+        rec["seq"][slot] = self._seq
+        rec["timestamp"][slot] = timestamp
+        rec["monotonic"][slot] = monotonic
+        if warpMatrix is None or len(warpMatrix) == 0:
+            rec["warpMatrix"][slot] = np.nan
+        else:
+            rec["warpMatrix"][slot] = warpMatrix
+        rec["payloadSize"][slot] = len(payload)
+        rec["payload"][slot, : len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        rec["frame"][slot] = small.reshape(self.frameShape)
+        rec["valid"][slot] = 1
+        self._header["head"] = head + 1
+        self._seq += 1
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._records.flush()
+        self._header.flush()
+
+
+class FlightRecording:
+    """
+    Read a ring file written by FlightRecorder
+
+    Records are sorted by wall-clock timestamp, index 0 being the oldest
+    record still in the file. The Pi has no real-time clock: if NTP steps
+    the clock during a match, the timestamp order can differ from the
+    capture order, which is given by seq (and by monotonic within one boot).
+
+    Methods
+    -------
+    timestamps()
+        timestamps of the records
+    seek(timestamp)
+        index of the last record at or before timestamp
+    cakeDetector(index)
+        CakeDetector calibrated for the stored frame of a record
+    replay(start, stop)
+        run the detector again on recorded frames
+    """
+
+    def __init__(self, path):
+        header = np.memmap(path, dtype=HEADER_DTYPE, mode="r", shape=(1,))[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a flight recorder file")
+        self.nbSlots = int(header["nbSlots"])
+        self.frameShape = tuple(int(v) for v in header["frameShape"])
+        self.sourceShape = tuple(int(v) for v in header["sourceShape"])
+        dtype = _recordDtype(self.frameShape, int(header["maxPayload"]))
+        self._records = np.memmap(
+            path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(self.nbSlots,)
+        )
+        valid = np.flatnonzero(self._records["valid"] == 1)
+        bySeq = valid[np.argsort(self._records["seq"][valid], kind="stable")]
+        # Tri par timestamp pour que seek() puisse faire une recherche binaire
+        timestamps = self._records["timestamp"][bySeq]
+        self._order = bySeq[np.argsort(timestamps, kind="stable")]
+        self._timestamps = np.asarray(self._records["timestamp"][self._order])
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getitem__(self, index):
+        rec = self._records[self._order[index]]
+        size = int(rec["payloadSize"])
+        frame = np.asarray(rec["frame"])
+        if frame.shape[2] == 1:
+            frame = frame[:, :, 0]
+        return dict(
+            seq=int(rec["seq"]),
+            timestamp=float(rec["timestamp"]),
+            monotonic=float(rec["monotonic"]),
+            frame=frame,
+            warpMatrix=np.array(rec["warpMatrix"]),
+            detections=json.loads(rec["payload"][:size].tobytes()),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def timestamps(self):
+        return self._timestamps
+
+    def seek(self, timestamp):
+        index = int(np.searchsorted(self._timestamps, timestamp, side="right")) - 1
+        if index < 0:
+            raise KeyError(f"No record before {timestamp}")
+        return index
+
+    def cakeDetector(self, index):
+        """Créer un CakeDetector avec la calibration enregistrée"""
+        warpMatrix = self[index]["warpMatrix"]
+        if np.isnan(warpMatrix).any():
+            raise ValueError(f"Record {index} has no calibration")
+        # La matrice est exprimée pour la frame source, on la ramène à la
+        # frame réduite stockée
+        sy = self.sourceShape[0] / self.frameShape[0]
+        sx = self.sourceShape[1] / self.frameShape[1]
+        detector = cd.CakeDetector()
+        detector.warpMatrix = warpMatrix @ np.diag([sx, sy, 1.0])
+        return detector
+
+    def replay(self, start=None, stop=None):
+        """Rejouer la détection entre deux timestamps"""
+        ts = self._timestamps
+        first = 0 if start is None else max(int(np.searchsorted(ts, start, "right")) - 1, 0)
+        last = len(self) if stop is None else int(np.searchsorted(ts, stop, "right"))
+        for i in range(first, last):
+            record = self[i]
+            try:
+                cakes = self.cakeDetector(i).detectCakes(record["frame"])
+                error = None
+            except Exception as e:
+                cakes = None
+                error = repr(e)
+            yield record, cakes, error
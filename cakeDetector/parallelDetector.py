@@ -0,0 +1,251 @@
+##########################################################
+#               PARALLEL CAKE DETECTOR                   #
+##########################################################
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from cakeDetector import cakeDetector as cd
+
+
+class FrameRing:
+    """
+    Ring buffer of frames stored in shared memory
+
+    Frames are copied once into a slot of the ring, worker processes
+    attach to the same block and read the slot in place.
+
+    Attributes
+    ----------
+    shape : tuple
+        shape of one frame
+    dtype : numpy.dtype
+        dtype of one frame
+    nbSlots : int
+        number of frames the ring can hold
+    name : str
+        name of the shared memory block
+
+    Methods
+    -------
+    write(slot, frame)
+        copy frame into slot
+    read(slot)
+        view of the frame stored in slot
+    close()
+        detach from the shared memory block
+    unlink()
+        free the shared memory block
+    """
+
+    def __init__(self, shape, dtype, nbSlots, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.nbSlots = nbSlots
+        frameSize = int(np.prod(self.shape)) * self.dtype.itemsize
+        if name is None:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=frameSize * nbSlots
+            )
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self._frames = np.ndarray(
+            (nbSlots,) + self.shape, dtype=self.dtype, buffer=self._shm.buf
+        )
+
+    def write(self, slot, frame):
+        self._frames[slot] = frame
+
+    def read(self, slot):
+        return self._frames[slot]
+
+    def close(self):
+        del self._frames
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+def _worker(ringName, shape, dtype, nbSlots, warpMatrix, tasks, results, cvThreads):
+    """Boucle d'un process de détection"""
+    # Le parallélisme est entre les process : les threads internes d'OpenCV
+    # de chaque worker se disputeraient les mêmes cœurs
+    cv2.setNumThreads(cvThreads)
+    ring = FrameRing(shape, dtype, nbSlots, name=ringName)
+    detector = cd.CakeDetector()
+    detector.warpMatrix = warpMatrix
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot = task
+            try:
+                cakes = detector.detectCakes(ring.read(slot))
+                error = None
+            except Exception as e:
+                cakes = None
+                error = repr(e)
+            results.put((seq, slot, cakes, error))
+    finally:
+        ring.close()
+
+
+class ParallelCakeDetector:
+    """
+    Run CakeDetector in a pool of processes, one frame per process
+
+    Frames are written into a shared memory ring and dispatched to the
+    workers in turn. Results are tagged with the frame sequence number and
+    given back in submission order. submit() and getResult() raise
+    RuntimeError if a worker process died.
+
+    Attributes
+    ----------
+    nbWorkers : int
+        number of detection processes
+    cvThreads : int
+        number of OpenCV threads in each process
+    ring : FrameRing
+        shared memory ring of frames
+
+    Methods
+    -------
+    submit(frame)
+        queue a frame for detection, return its sequence number
+    getResult(timeout)
+        next result in submission order as (seq, cakes, error)
+    detectCakes(frames)
+        detect cakes on an iterable of frames, yield results in order
+    close()
+        stop workers and free shared memory
+    """
+
+    pollInterval = 0.1  # période de vérification des workers en attente
+
+    def __init__(
+        self, warpMatrix, frameShape, dtype=np.uint8, nbWorkers=4, nbSlots=None, cvThreads=1
+    ):
+        self.nbWorkers = nbWorkers
+        self.cvThreads = cvThreads
+        if nbSlots is None:
+            nbSlots = 2 * nbWorkers
+        self.ring = FrameRing(frameShape, dtype, nbSlots)
+        self._freeSlots = list(range(nbSlots))
+        self._pending = {}
+        self._nextSeq = 0
+        self._nextResult = 0
+        ctx = mp.get_context("spawn")
+        self._results = ctx.Queue()
+        self._tasks = []
+        self._workers = []
+        for _ in range(nbWorkers):
+            tasks = ctx.Queue()
+            worker = ctx.Process(
+                target=_worker,
+                args=(
+                    self.ring.name,
+                    self.ring.shape,
+                    self.ring.dtype.str,
+                    nbSlots,
+                    np.asarray(warpMatrix),
+                    tasks,
+                    self._results,
+                    cvThreads,
+                ),
+                daemon=True,
+            )
+            worker.start()
+            self._tasks.append(tasks)
+            self._workers.append(worker)
+
+    @classmethod
+    def fromDetector(cls, detector, frameShape, **kwargs):
+        """Créer le pool à partir d'un CakeDetector déjà calibré"""
+        return cls(detector.warpMatrix, frameShape, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _checkWorkers(self):
+        for i, worker in enumerate(self._workers):
+            if not worker.is_alive():
+                raise RuntimeError(
+                    f"Detection worker {i} exited with code {worker.exitcode}"
+                )
+
+    def _collect(self, timeout=None):
+        # Attente par petits pas pour détecter un worker mort au lieu de
+        # bloquer indéfiniment sur la queue
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.pollInterval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            try:
+                seq, slot, cakes, error = self._results.get(timeout=wait)
+                break
+            except queue.Empty:
+                self._checkWorkers()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+        self._freeSlots.append(slot)
+        self._pending[seq] = (seq, cakes, error)
+
+    def submit(self, frame):
+        self._checkWorkers()
+        while not self._freeSlots:
+            self._collect()
+        slot = self._freeSlots.pop()
+        self.ring.write(slot, frame)
+        seq = self._nextSeq
+        self._nextSeq += 1
+        self._tasks[seq % self.nbWorkers].put((seq, slot))
+        return seq
+
+    def inFlight(self):
+        return self._nextSeq - self._nextResult
+
+    def getResult(self, timeout=None):
+        """
+        Return the next result in submission order
+
+        Raise queue.Empty if it is not ready within timeout.
+        """
+        if self._nextResult >= self._nextSeq:
+            raise queue.Empty
+        while self._nextResult not in self._pending:
+            self._collect(timeout)
+        result = self._pending.pop(self._nextResult)
+        self._nextResult += 1
+        return result
+
+    def detectCakes(self, frames):
+        for frame in frames:
+            self.submit(frame)
+            while self.inFlight() >= self.ring.nbSlots:
+                yield self.getResult()
+        while self.inFlight():
+            yield self.getResult()
+
+    def close(self):
+        if not self._workers:
+            return
+        for tasks in self._tasks:
+            tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self.ring.close()
+        self.ring.unlink()
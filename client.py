@@ -3,7 +3,11 @@ import os
 import sys
 import time
 import signal
+import queue
 from cakeDetector import cakeDetector as cd
+from cakeDetector import parallelDetector as pd
+from cakeDetector import flightRecorder as fr
+from cakeDetector import debugRenderer as dr
 import cv2
 import logging
 import colorlog
@@ -15,10 +19,15 @@ from dotenv import load_dotenv
 class PiCam:
     tcp_socket: socket
     cakeDetector: cd.CakeDetector
+    parallelDetector: pd.ParallelCakeDetector
+    debugRenderer: dr.DebugRenderer
 
     def __init__(self):
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.cakeDetector = cd.CakeDetector()
+        self.parallelDetector = None
+        self.debugRenderer = None
+        self._submitted = {}
 
     def calibrate_camera(self, camera):
         try:
@@ -30,6 +39,17 @@ class PiCam:
         except Exception as e:
             logger.error(f"Unable to init detector : {e}")
 
+    def start_parallel(self, camera, nbWorkers):
+        """Lancer la détection sur plusieurs process"""
+        if len(self.cakeDetector.warpMatrix) == 0:
+            logger.warning("Detector not calibrated, parallel mode disabled")
+            return
+        frame = camera.capture_array()
+        self.parallelDetector = pd.ParallelCakeDetector.fromDetector(
+            self.cakeDetector, frame.shape, dtype=frame.dtype, nbWorkers=nbWorkers
+        )
+        logger.info(f"Parallel detector started with {nbWorkers} workers")
+
     def connect_to_server(self, host, port):
         """Connecter le socket au serveur"""
         try:
@@ -46,21 +66,61 @@ class PiCam:
     def send_data(self, message):
         """Envoyer des données au serveur"""
         try:
-            self.tcp_socket.send(message.encode())
+            # Une observation par ligne (voir server.py)
+            self.tcp_socket.sendall((message + "\n").encode())
             logger.debug("Données envoyées au serveur")
         except Exception as e:
             logger.error(f"{e}")
 
     def close_connection(self):
+        if self.parallelDetector is not None:
+            self.parallelDetector.close()
+            self.parallelDetector = None
+        if self.debugRenderer is not None:
+            self.debugRenderer.close()
+            self.debugRenderer = None
         self.tcp_socket.close()
         logger.info("Connection closed")
 
     def watch(self, frame):
-        # return self.cakeDetector.detectCakes()
-        return [
-            {"IM": "1"},
-            {"CANIBALIST": "2"},
-        ]
+        """
+        Détecter les gâteaux
+
+        Renvoie la liste des (frame, gâteaux) dont la détection est terminée,
+        vide en mode parallèle si aucun résultat n'est prêt.
+        """
+        results = []
+        if self.parallelDetector is not None:
+            try:
+                results = self.watch_parallel(frame)
+            except RuntimeError as e:
+                logger.error(f"Parallel detector stopped, back to sequential : {e}")
+                self.parallelDetector.close()
+                self.parallelDetector = None
+                self._submitted = {}
+        if self.parallelDetector is None:
+            results = [(frame, self.cakeDetector.detectCakes(frame))]
+        if self.debugRenderer is not None and results:
+            self.debugRenderer.submit(*results[-1], self.cakeDetector.warpMatrix)
+        return results
+
+    def watch_parallel(self, frame):
+        # Les frames sont gardées jusqu'à leur résultat pour renvoyer chaque
+        # détection avec la frame qui l'a produite
+        seq = self.parallelDetector.submit(frame)
+        self._submitted[seq] = frame
+        results = []
+        while True:
+            try:
+                seq, cakes, error = self.parallelDetector.getResult(timeout=0)
+            except queue.Empty:
+                break
+            frame = self._submitted.pop(seq)
+            if error is not None:
+                logger.error(f"Frame {seq} : {error}")
+            else:
+                results.append((frame, cakes))
+        return results
 
 def generate_fake_payload():
     cakes = [
@@ -106,29 +166,57 @@ def main(args):
     picam.receive_data()
     frequency = 1  # envoi du message toutes les secondes
     signal.signal(signal.SIGTERM, lambda signum, frame: picam.close_connection())
+    snapshotPath = os.getenv("DEBUG_SNAPSHOT")
+    if snapshotPath:
+        picam.debugRenderer = dr.DebugRenderer(path=snapshotPath)
+        logger.info(f"Debug snapshots written to {snapshotPath}")
     picam.calibrate_camera(camera)
+    nbWorkers = int(os.getenv("DETECTOR_WORKERS", "1"))
+    if nbWorkers > 1:
+        picam.start_parallel(camera, nbWorkers)
+
+    # Enregistreur de vol
+    recorder = None
+    recordPath = os.getenv("FLIGHT_RECORDER")
+    if recordPath:
+        recorder = fr.FlightRecorder(
+            recordPath,
+            camera.capture_array().shape,
+            scale=float(os.getenv("FLIGHT_RECORDER_SCALE", "1")),
+            nbSlots=int(os.getenv("FLIGHT_RECORDER_SLOTS", "300")),
+        )
+        logger.info(f"Flight recorder writing to {recordPath}")
 
     # Observe le plateau de jeu
-    while True:
-        try:
-            frame = camera.capture_array()
-            #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            data = picam.watch(frame)
-            data = generate_fake_payload()
-            payload = json.dumps(data)
-        except Exception as e:
-            logger.error(f"Unable to watch : {e}")
-            continue
-        time.sleep(frequency)
-
-        # Envoie les données au serveur
-        try:
+    try:
+        while True:
+            try:
+                frame = camera.capture_array()
+                #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                results = picam.watch(frame)
+                if recorder is not None:
+                    for resultFrame, cakes in results:
+                        recorder.record(resultFrame, cakes, picam.cakeDetector.warpMatrix)
+                if not results:
+                    continue  # mode parallèle : pas encore de résultat
+                cakes = results[-1][1]
+                data = dict(cakes=cakes, cherryDispensers=[])
+                payload = json.dumps(data)
+            except Exception as e:
+                logger.error(f"Unable to watch : {e}")
+                continue
+            if picam.parallelDetector is None:
+                time.sleep(frequency)
+
+            # Envoie les données au serveur
             picam.send_data(payload)
-
-        except KeyboardInterrupt:
-            camera.close()
-            picam.close_connection()
-            break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if recorder is not None:
+            recorder.close()
+        camera.close()
+        picam.close_connection()
 
 
 
@@ -155,6 +243,7 @@ if __name__ == "__main__":
     )
     handler.setFormatter(formatter)
     logger = colorlog.getLogger(__name__)
-    logger.addHandler(handler)
+    # Handler sur le logger racine pour afficher aussi les logs des modules
+    colorlog.getLogger().addHandler(handler)
     logger.setLevel(logging.DEBUG)
     main(sys.argv)
@@ -0,0 +1,353 @@
+##########################################################
+#                   OBSERVATION STORE                    #
+##########################################################
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+
+MAX_LAYERS = 3
+
+CAKE_FIELDS = {
+    "timestamp": ("<f8", ()),
+    "obs": ("<u8", ()),
+    "x": ("<f4", ()),
+    "y": ("<f4", ()),
+    "hasCherry": ("?", ()),
+    "nbLayers": ("u1", ()),
+    "layers": ("i1", (MAX_LAYERS,)),
+}
+
+DISPENSER_FIELDS = {
+    "timestamp": ("<f8", ()),
+    "obs": ("<u8", ()),
+    "id": ("<i2", ()),
+    "nbCherries": ("<i2", ()),
+}
+
+
+def _checked(fields, name, value):
+    """Convertir value pour la colonne name, ValueError hors de son domaine"""
+    dtype = np.dtype(fields[name][0])
+    if dtype.kind in "iu":
+        value = int(value)
+        info = np.iinfo(dtype)
+        if not info.min <= value <= info.max:
+            raise ValueError(f"{name}={value} out of range [{info.min}, {info.max}]")
+    else:
+        value = float(value)
+        # Rejette aussi nan et inf
+        if not abs(value) <= float(np.finfo(dtype).max):
+            raise ValueError(f"{name}={value} out of range for {dtype}")
+    return value
+
+
+class Chunk:
+    """
+    Fixed-size block of rows stored column by column
+
+    Attributes
+    ----------
+    columns : dict
+        one numpy array per field
+    size : int
+        number of rows written
+    tmin, tmax : float
+        first and last timestamp of the chunk
+    path : str
+        file of the chunk once persisted
+    """
+
+    def __init__(self, fields, capacity):
+        self.columns = {
+            name: np.empty((capacity,) + shape, dtype=dtype)
+            for name, (dtype, shape) in fields.items()
+        }
+        self.capacity = capacity
+        self.size = 0
+        self.tmin = np.inf
+        self.tmax = -np.inf
+        self.path = None
+
+    def full(self):
+        return self.size >= self.capacity
+
+    def append(self, row):
+        i = self.size
+        for name, value in row.items():
+            self.columns[name][i] = value
+        t = row["timestamp"]
+        self.tmin = min(self.tmin, t)
+        self.tmax = max(self.tmax, t)
+        self.size += 1
+
+    def select(self, start, stop):
+        """Lignes dont le timestamp est dans [start, stop]"""
+        ts = self.columns["timestamp"][: self.size]
+        a = int(np.searchsorted(ts, start, side="left"))
+        b = int(np.searchsorted(ts, stop, side="right"))
+        return {name: col[a:b] for name, col in self.columns.items()}
+
+    def save(self, path):
+        np.savez(path, **{name: col[: self.size] for name, col in self.columns.items()})
+        self.path = path
+
+    def unload(self):
+        self.columns = None
+
+    def load(self):
+        with np.load(self.path) as data:
+            self.columns = {name: data[name] for name in data.files}
+
+    @classmethod
+    def fromFile(cls, fields, path):
+        """Chunk scellé relu depuis le disque"""
+        chunk = cls.__new__(cls)
+        chunk.path = path
+        chunk.load()
+        ts = chunk.columns["timestamp"]
+        chunk.size = chunk.capacity = len(ts)
+        chunk.tmin = float(ts[0]) if len(ts) else np.inf
+        chunk.tmax = float(ts[-1]) if len(ts) else -np.inf
+        return chunk
+
+
+class Table:
+    """
+    Append-only columnar table sorted by timestamp
+
+    Sealed chunks are written to disk as .npz files and only the most recent
+    ones are kept in memory. Older chunks are reloaded when a query needs
+    them and unloaded again afterwards. Chunks already in the directory are
+    read back at start-up, so the table survives a server restart.
+
+    Methods
+    -------
+    append(row)
+        append a row, timestamps must not decrease
+    select(start, stop)
+        rows with start <= timestamp <= stop, as a dict of arrays
+    flush()
+        persist the current chunk
+    """
+
+    def __init__(self, fields, directory=None, chunkSize=4096, chunksInMemory=16):
+        self.fields = fields
+        self.directory = directory
+        self.chunkSize = chunkSize
+        self.chunksInMemory = chunksInMemory
+        self.chunks = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for path in sorted(glob.glob(os.path.join(directory, "chunk_*.npz"))):
+                self.chunks.append(Chunk.fromFile(fields, path))
+            self._evict()
+        self.chunks.append(Chunk(fields, chunkSize))
+
+    def __len__(self):
+        return sum(c.size for c in self.chunks)
+
+    def append(self, row):
+        current = self.chunks[-1]
+        if current.full():
+            self._seal(current)
+            current = Chunk(self.fields, self.chunkSize)
+            self.chunks.append(current)
+        current.append(row)
+
+    def _seal(self, chunk):
+        if self.directory is None:
+            return
+        index = len(self.chunks) - 1
+        chunk.save(os.path.join(self.directory, f"chunk_{index:06d}.npz"))
+        self._evict()
+
+    def _evict(self):
+        """Ne garder en mémoire que les chunksInMemory chunks les plus récents"""
+        # Le dernier chunk est celui en cours d'écriture, il reste en mémoire
+        loaded = [c for c in self.chunks[:-1] if c.columns is not None and c.path is not None]
+        for old in loaded[: max(len(loaded) - self.chunksInMemory, 0)]:
+            old.unload()
+
+    def last(self, field):
+        """Valeur de field sur la dernière ligne, None si la table est vide"""
+        for chunk in reversed(self.chunks):
+            if chunk.size:
+                if chunk.columns is None:
+                    chunk.load()
+                value = chunk.columns[field][chunk.size - 1]
+                self._evict()
+                return value
+        return None
+
+    def select(self, start=-np.inf, stop=np.inf):
+        parts = []
+        for chunk in self.chunks:
+            if chunk.size == 0 or chunk.tmax < start or chunk.tmin > stop:
+                continue
+            if chunk.columns is None:
+                chunk.load()
+            parts.append(chunk.select(start, stop))
+        self._evict()
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {
+                name: np.empty((0,) + shape, dtype=dtype)
+                for name, (dtype, shape) in self.fields.items()
+            }
+        return {name: np.concatenate([p[name] for p in parts]) for name in self.fields}
+
+    def flush(self):
+        if self.directory is None:
+            return
+        current = self.chunks[-1]
+        if current.size:
+            index = len(self.chunks) - 1
+            current.save(os.path.join(self.directory, f"chunk_{index:06d}.npz"))
+
+
+class ObservationStore:
+    """
+    Time-indexed store of the observations sent by the cameras
+
+    Each camera has its own cake and dispenser tables, so rows of a table
+    are sorted by timestamp and range queries are binary searches.
+
+    Attributes
+    ----------
+    directory : str
+        folder where chunks are persisted, None to keep everything in memory
+    chunkSize : int
+        number of rows per chunk
+
+    Methods
+    -------
+    append(camera, payload, timestamp)
+        store one payload (mapElements) received from a camera
+    cakes(camera, start, stop)
+        cakes seen between two timestamps
+    recentCakes(camera, window)
+        cakes seen in the last window seconds
+    dispensers(camera, start, stop, dispenserId)
+        cherry dispenser counts between two timestamps
+    dispenserChanges(camera, dispenserId, start, stop)
+        timestamps and counts where a dispenser count changed
+    flush()
+        persist all tables
+    """
+
+    def __init__(self, directory=None, chunkSize=4096, chunksInMemory=16):
+        self.directory = directory
+        self.chunkSize = chunkSize
+        self.chunksInMemory = chunksInMemory
+        self._cakes = {}
+        self._dispensers = {}
+        self._nbObs = {}
+        self._lock = threading.Lock()
+        if directory is not None and os.path.isdir(directory):
+            for camera in sorted(os.listdir(directory)):
+                if os.path.isdir(os.path.join(directory, camera)):
+                    self._tables(camera)
+
+    def _tables(self, camera):
+        if camera not in self._cakes:
+            base = None
+            if self.directory is not None:
+                base = os.path.join(self.directory, str(camera))
+            self._cakes[camera] = Table(
+                CAKE_FIELDS,
+                None if base is None else os.path.join(base, "cakes"),
+                self.chunkSize,
+                self.chunksInMemory,
+            )
+            self._dispensers[camera] = Table(
+                DISPENSER_FIELDS,
+                None if base is None else os.path.join(base, "dispensers"),
+                self.chunkSize,
+                self.chunksInMemory,
+            )
+            last = [t.last("obs") for t in (self._cakes[camera], self._dispensers[camera])]
+            last = [int(v) for v in last if v is not None]
+            self._nbObs[camera] = max(last) + 1 if last else 0
+        return self._cakes[camera], self._dispensers[camera]
+
+    def cameras(self):
+        return list(self._cakes)
+
+    def append(self, camera, payload, timestamp=None):
+        """
+        Store one payload, all or nothing
+
+        Raise KeyError, TypeError, ValueError, OverflowError or
+        AttributeError on a malformed payload, in which case nothing is
+        stored. Values are checked against the column types before any row
+        is written.
+        """
+        cakeRows = []
+        for cake in payload.get("cakes", []):
+            layers = [
+                _checked(CAKE_FIELDS, "layers", l)
+                for l in cake.get("layers", [])
+                if l is not None
+            ]
+            layers = layers[:MAX_LAYERS]
+            cakeRows.append(
+                dict(
+                    x=_checked(CAKE_FIELDS, "x", cake["x"]),
+                    y=_checked(CAKE_FIELDS, "y", cake["y"]),
+                    hasCherry=bool(cake.get("hasCherry", False)),
+                    nbLayers=len(layers),
+                    layers=layers + [-1] * (MAX_LAYERS - len(layers)),
+                )
+            )
+        dispenserRows = [
+            dict(
+                id=_checked(DISPENSER_FIELDS, "id", dispenser["id"]),
+                nbCherries=_checked(DISPENSER_FIELDS, "nbCherries", dispenser["nbCherries"]),
+            )
+            for dispenser in payload.get("cherryDispensers", [])
+        ]
+
+        with self._lock:
+            # Horodaté sous le verrou pour garder les tables triées
+            if timestamp is None:
+                timestamp = time.time()
+            cakes, dispensers = self._tables(camera)
+            obs = self._nbObs[camera]
+            self._nbObs[camera] += 1
+            for row in cakeRows:
+                cakes.append(dict(row, timestamp=timestamp, obs=obs))
+            for row in dispenserRows:
+                dispensers.append(dict(row, timestamp=timestamp, obs=obs))
+
+    def cakes(self, camera, start=-np.inf, stop=np.inf):
+        with self._lock:
+            return self._tables(camera)[0].select(start, stop)
+
+    def recentCakes(self, camera, window, now=None):
+        if now is None:
+            now = time.time()
+        return self.cakes(camera, now - window, now)
+
+    def dispensers(self, camera, start=-np.inf, stop=np.inf, dispenserId=None):
+        with self._lock:
+            rows = self._tables(camera)[1].select(start, stop)
+        if dispenserId is not None:
+            mask = rows["id"] == dispenserId
+            rows = {name: col[mask] for name, col in rows.items()}
+        return rows
+
+    def dispenserChanges(self, camera, dispenserId, start=-np.inf, stop=np.inf):
+        """Instants où le nombre de cerises d'un distributeur a changé"""
+        rows = self.dispensers(camera, start, stop, dispenserId)
+        counts = rows["nbCherries"]
+        changes = np.flatnonzero(np.diff(counts)) + 1
+        return rows["timestamp"][changes], counts[changes]
+
+    def flush(self):
+        with self._lock:
+            for table in list(self._cakes.values()) + list(self._dispensers.values()):
+                table.flush()
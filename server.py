@@ -3,30 +3,73 @@ from _thread import *
 import logging
 import colorlog
 import os
+import json
+import time
 from dotenv import load_dotenv
+from observationStore import ObservationStore
+
+
+def camera_name(ip):
+    """Nom de la caméra à partir de son IP (.env), sinon l'IP"""
+    for name in ('CANIBALIST', 'MEDOR'):
+        if os.getenv(f'{name}_IP') == ip:
+            return name
+    return ip
+
+
+def handle_message(camera, message):
+    """Stocker une observation, renvoyer la réponse pour le client"""
+    logger.debug(f'Client: {message}')
+    try:
+        store.append(camera, json.loads(message))
+    except (ValueError, KeyError, TypeError, OverflowError, AttributeError) as e:
+        logger.warning(f'Observation ignored : {e!r}')
+        return f'Server: ignored {e!r}'
+    return f'Server: {message}'
 
 
 def client_handler(connection):
     connection.send(
         str.encode(
-            'You are now connected to the replay server... Type BYE to stop'))
+            'You are now connected to the replay server... Type BYE to stop\n'))
     client_info = connection.getpeername()
-    while True:
+    camera = camera_name(client_info[0])
+    # Une observation JSON par ligne, TCP pouvant couper ou coller les messages
+    buffer = b''
+    running = True
+    while running:
         try:
             data = connection.recv(2048)
-            message = data.decode('utf-8')
-            if message == 'BYE':
+            if not data:
+                logger.error(f"Client disconnected {client_info}")
                 break
-            else:
-                logger.debug(f'Client: {message}')
-            reply = f'Server: {message}'
-            connection.sendall(str.encode(reply))
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                message = line.decode('utf-8').strip()
+                if message == 'BYE':
+                    running = False
+                    break
+                if message:
+                    reply = handle_message(camera, message)
+                    connection.sendall(str.encode(reply + '\n'))
         except:
             logger.error(f"Client disconnected {client_info}")
             break
+    store.flush()
     connection.close()
 
 
+def flush_store(period):
+    """Sauvegarder le store régulièrement, sans attendre une déconnexion"""
+    while True:
+        time.sleep(period)
+        try:
+            store.flush()
+        except Exception as e:
+            logger.error(f"Unable to flush observations : {e}")
+
+
 def accept_connections(ServerSocket):
     client, address = ServerSocket.accept()
     logger.info('Connected to: ' + address[0] + ':' + str(address[1]))
@@ -64,6 +107,9 @@ if __name__ == '__main__':
     logger.addHandler(handler)
     logger.setLevel(logging.DEBUG)
 
+    store = ObservationStore(os.getenv('OBSERVATION_DIR'))
+    start_new_thread(flush_store, (float(os.getenv('OBSERVATION_FLUSH', '10')), ))
+
     ServerSocket = socket.socket()
     try:
         ServerSocket.bind((host, port))
@@ -72,5 +118,8 @@ if __name__ == '__main__':
     logger.info(f'Server is listing on the port {port}...')
     ServerSocket.listen()
 
-    while True:
-        accept_connections(ServerSocket)
+    try:
+        while True:
+            accept_connections(ServerSocket)
+    finally:
+        store.flush()
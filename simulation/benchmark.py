@@ -0,0 +1,277 @@
+##########################################################
+#                   BENCHMARK                            #
+##########################################################
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from cakeDetector import cakeDetector as cd
+from cakeDetector import parallelDetector as pd
+from simulation.tableRenderer import TableRenderer
+
+
+def matchDetections(detected, truth, maxDistance=100):
+    """
+    Associer les détections à la vérité terrain (plus proche voisin)
+
+    Return a dict with the number of true positives, false positives,
+    false negatives, the mean position error in mm and the ratio of
+    cakes whose layers are all correct.
+    """
+    used = set()
+    errors = []
+    goodLayers = 0
+    for cake in detected:
+        best, bestDistance = None, maxDistance
+        for i, t in enumerate(truth):
+            if i in used:
+                continue
+            distance = np.hypot(cake["x"] - t["x"], cake["y"] - t["y"])
+            if distance < bestDistance:
+                best, bestDistance = i, distance
+        if best is None:
+            continue
+        used.add(best)
+        errors.append(bestDistance)
+        goodLayers += cake["layers"] == truth[best]["layers"]
+    tp = len(used)
+    return dict(
+        tp=tp,
+        fp=len(detected) - tp,
+        fn=len(truth) - tp,
+        error=float(np.mean(errors)) if errors else float("nan"),
+        layers=goodLayers / tp if tp else float("nan"),
+    )
+
+
+def calibratedDetector(renderer, seed=0):
+    """CakeDetector calibré sur une table vide"""
+    detector = cd.CakeDetector()
+    frame, _ = renderer.scene(0, seed)
+    detector.initDetector(frame)
+    return detector
+
+
+def benchmarkDetector(renderer, cakeCounts, nbFrames=5, nbWorkers=1, seed=0):
+    """Précision et débit de CakeDetector selon le nombre de gâteaux"""
+    detector = calibratedDetector(renderer, seed)
+    pool = None
+    if nbWorkers > 1:
+        # Pool créé et chauffé hors chrono : le lancement des process et
+        # l'import de cv2 ne comptent pas dans le débit
+        warmup, _ = renderer.scene(1, seed)
+        pool = pd.ParallelCakeDetector.fromDetector(
+            detector, warmup.shape, nbWorkers=nbWorkers
+        )
+        list(pool.detectCakes([warmup] * nbWorkers))
+    try:
+        return _benchmarkDetector(renderer, detector, pool, cakeCounts, nbFrames, seed)
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def _benchmarkDetector(renderer, detector, pool, cakeCounts, nbFrames, seed):
+    rows = []
+    for nbCakes in cakeCounts:
+        scenes = [renderer.scene(nbCakes, seed + i) for i in range(nbFrames)]
+        frames = [frame for frame, _ in scenes]
+        start = time.perf_counter()
+        if pool is not None:
+            results = [cakes for _, cakes, _ in pool.detectCakes(frames)]
+        else:
+            results = []
+            for frame in frames:
+                try:
+                    results.append(detector.detectCakes(frame))
+                except Exception:
+                    results.append(None)
+        elapsed = time.perf_counter() - start
+
+        scores = [
+            matchDetections(cakes or [], truth)
+            for cakes, (_, truth) in zip(results, scenes)
+        ]
+        tp = sum(s["tp"] for s in scores)
+        rows.append(
+            dict(
+                cakes=nbCakes,
+                fps=nbFrames / elapsed,
+                recall=tp / max(nbCakes * nbFrames, 1),
+                precision=tp / max(tp + sum(s["fp"] for s in scores), 1),
+                error=np.nanmean([s["error"] for s in scores]),
+                layers=np.nanmean([s["layers"] for s in scores]),
+                failures=sum(cakes is None for cakes in results),
+            )
+        )
+    return rows
+
+
+class FakeCamera:
+    """
+    Fake camera client streaming synthetic observations to server.py
+
+    Each payload is sent and its reply awaited, so the measured latency
+    is the round trip through the server. A reply that is not the echo of
+    the payload means the server did not store it and is counted in
+    ignored.
+
+    Attributes
+    ----------
+    payloads : list
+        mapElements sent in turn
+    rate : float
+        number of payloads per second
+    latencies : list
+        round trip time of each payload in seconds
+    ignored : int
+        number of payloads the server did not store
+    errors : int
+        number of connection errors
+    """
+
+    def __init__(self, host, port, payloads, rate=10.0):
+        self.host = host
+        self.port = port
+        self.payloads = payloads
+        self.rate = rate
+        self.latencies = []
+        self.ignored = 0
+        self.errors = 0
+
+    def run(self, duration):
+        try:
+            sock = socket.create_connection((self.host, self.port))
+        except OSError:
+            self.errors += 1
+            return
+        replies = sock.makefile("rb")
+        try:
+            if not replies.readline():  # message de bienvenue
+                raise socket.error("connection closed")
+            self._stream(sock, replies, duration)
+            sock.sendall(b"BYE\n")
+        except OSError:
+            self.errors += 1
+        finally:
+            replies.close()
+            sock.close()
+
+    def _stream(self, sock, replies, duration):
+        period = 1 / self.rate
+        end = time.monotonic() + duration
+        k = 0
+        nextSend = time.monotonic()
+        while time.monotonic() < end:
+            message = json.dumps(self.payloads[k % len(self.payloads)]).encode()
+            k += 1
+            start = time.perf_counter()
+            sock.sendall(message + b"\n")
+            # une ligne de réponse par observation
+            reply = replies.readline()
+            if not reply:
+                raise socket.error("connection closed")
+            if reply != b"Server: " + message + b"\n":
+                self.ignored += 1
+            self.latencies.append(time.perf_counter() - start)
+            nextSend += period
+            time.sleep(max(nextSend - time.monotonic(), 0))
+
+
+def scenePayloads(renderer, nbCakes, nbPayloads, detector=None, seed=0):
+    """Payloads tirés de scènes synthétiques, détectés ou vérité terrain"""
+    payloads = []
+    for i in range(nbPayloads):
+        frame, truth = renderer.scene(nbCakes, seed + i)
+        cakes = truth
+        if detector is not None:
+            try:
+                cakes = detector.detectCakes(frame)
+            except Exception:
+                cakes = []
+        cakes = [
+            dict(x=float(c["x"]), y=float(c["y"]), hasCherry=c["hasCherry"], layers=c["layers"])
+            for c in cakes
+        ]
+        payloads.append(dict(cakes=cakes, cherryDispensers=[dict(id=0, nbCherries=10)]))
+    return payloads
+
+
+def benchmarkServer(host, port, clientCounts, payloads, rate=10.0, duration=5.0):
+    """Latence de server.py selon le nombre de clients connectés"""
+    rows = []
+    for nbClients in clientCounts:
+        cameras = [FakeCamera(host, port, payloads, rate) for _ in range(nbClients)]
+        threads = [threading.Thread(target=c.run, args=(duration,)) for c in cameras]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        latencies = np.array([l for c in cameras for l in c.latencies]) * 1000
+        rows.append(
+            dict(
+                clients=nbClients,
+                messages=len(latencies),
+                p50=np.percentile(latencies, 50) if len(latencies) else float("nan"),
+                p99=np.percentile(latencies, 99) if len(latencies) else float("nan"),
+                ignored=sum(c.ignored for c in cameras),
+                errors=sum(c.errors for c in cameras),
+            )
+        )
+    return rows
+
+
+def printRows(rows):
+    if not rows:
+        return
+    keys = list(rows[0])
+    print("  ".join(f"{k:>10}" for k in keys))
+    for row in rows:
+        print(
+            "  ".join(
+                f"{v:>10.3f}" if isinstance(v, float) else f"{v:>10}" for v in row.values()
+            )
+        )
+
+
+# ______________________________________________________________________________
+#                                   Main
+# ______________________________________________________________________________
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sur table synthétique")
+    parser.add_argument("--noise", type=float, default=4.0, help="bruit gaussien des pixels")
+    parser.add_argument("--pose-noise", type=float, default=0.0, help="bruit de pose caméra (mm)")
+    parser.add_argument("--seed", type=int, default=0)
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    det = sub.add_parser("detector", help="précision et débit de CakeDetector")
+    det.add_argument("--cakes", type=int, nargs="+", default=[1, 5, 10, 20])
+    det.add_argument("--frames", type=int, default=5)
+    det.add_argument("--workers", type=int, default=1)
+
+    srv = sub.add_parser("server", help="latence de server.py")
+    srv.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8])
+    srv.add_argument("--cakes", type=int, default=6)
+    srv.add_argument("--rate", type=float, default=10.0, help="messages/s par client")
+    srv.add_argument("--duration", type=float, default=5.0)
+    srv.add_argument("--detect", action="store_true", help="envoyer les détections au lieu de la vérité terrain")
+
+    args = parser.parse_args()
+    renderer = TableRenderer(noise=args.noise, poseNoise=args.pose_noise)
+
+    if args.mode == "detector":
+        printRows(benchmarkDetector(renderer, args.cakes, args.frames, args.workers, args.seed))
+    else:
+        load_dotenv()
+        host = os.getenv("MIRADOR_IP")
+        port = int(os.getenv("MIRADOR_PORT"))
+        detector = calibratedDetector(renderer, args.seed) if args.detect else None
+        payloads = scenePayloads(renderer, args.cakes, 10, detector, args.seed)
+        printRows(benchmarkServer(host, port, args.clients, payloads, args.rate, args.duration))
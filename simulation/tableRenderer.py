@@ -0,0 +1,262 @@
+##########################################################
+#                   TABLE RENDERER                       #
+##########################################################
+import cv2
+from cv2 import aruco
+import numpy as np
+
+# Coordonnées en mm dans le repère de la frame redressée du CakeDetector
+# (f = 1) : u suit les colonnes (largeur 2000), v les lignes (longueur 3000)
+TABLE_U = (50, 2050)
+TABLE_V = (50, 3050)
+WARP_SIZE = (2100, 3100)  # (colonnes, lignes)
+
+# Coin haut-gauche des tags de référence, choisi pour que les coins
+# utilisés par initDetector tombent sur pts2
+REFERENCE_TAGS = {
+    20: (1530, 2575),
+    21: (470, 2575),
+    22: (1530, 525),
+    23: (470, 525),
+}
+REFERENCE_TAG_SIZE = 100
+
+# Couleurs en RGB, passées en BGR au rendu
+LAYER_COLORS = {
+    0: (70, 45, 35),  # brun
+    1: (235, 185, 20),  # jaune
+    2: (235, 60, 165),  # rose
+}
+CAKE_TAGS = {0: 36, 1: 13, 2: 47}
+TABLE_COLOR = (90, 140, 200)
+CAKE_RADIUS = 60
+LAYER_HEIGHT = 20
+CAKE_TAG_SIZE = 50
+
+
+def markerImage(tagId, size):
+    """Tag aruco de size pixels avec une marge blanche d'une case"""
+    dictionary = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+    marker = aruco.generateImageMarker(dictionary, tagId, size)
+    pad = size // 6
+    return cv2.copyMakeBorder(marker, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255)
+
+
+class Camera:
+    """
+    Pinhole camera looking at the table
+
+    Heights are positive above the table. The frame of the CakeDetector is
+    a view from above with v going down, so z is flipped internally to keep
+    the markers readable (not mirrored).
+
+    Attributes
+    ----------
+    position : array
+        camera center (u, v, height) in mm
+    target : array
+        point of the table the camera looks at
+    resolution : tuple
+        (width, height) of the frames
+    focal : float
+        focal length in pixels
+
+    Methods
+    -------
+    project(points)
+        project (N, 3) points to pixels
+    planeHomography(z)
+        homography from the plane at height z to the image
+    """
+
+    def __init__(self, position=(1200, 3400, 1500), target=(1050, 1400, 0), resolution=(3840, 2160), focal=1700):
+        self.position = np.asarray(position, dtype=np.float64)
+        self.target = np.asarray(target, dtype=np.float64)
+        flip = np.array([1, 1, -1])
+        self.resolution = tuple(resolution)
+        self.focal = focal
+        w, h = self.resolution
+        self.K = np.array([[focal, 0, w / 2], [0, focal, h / 2], [0, 0, 1]])
+
+        forward = (self.target - self.position) * flip
+        forward /= np.linalg.norm(forward)
+        right = np.cross(forward, (0, 0, -1))
+        right /= np.linalg.norm(right)
+        down = np.cross(forward, right)
+        self.R = np.stack([right, down, forward])
+        self.t = -self.R @ (self.position * flip)
+
+    def jittered(self, rng, position=10.0, target=10.0):
+        """Copie de la caméra avec une pose légèrement bruitée"""
+        return Camera(
+            self.position + rng.normal(0, position, 3),
+            self.target + rng.normal(0, target, 3) * (1, 1, 0),
+            self.resolution,
+            self.focal,
+        )
+
+    def project(self, points):
+        points = np.asarray(points, dtype=np.float64) * (1, 1, -1)
+        p = (self.K @ (self.R @ points.T + self.t[:, None])).T
+        return p[:, :2] / p[:, 2:3]
+
+    def planeHomography(self, z=0):
+        r1, r2, r3 = self.R.T
+        return self.K @ np.stack([r1, r2, self.t - r3 * z], axis=1)
+
+
+class Cake:
+    """
+    Cake on the table
+
+    Attributes
+    ----------
+    u, v : float
+        position of the cake center in mm
+    layers : list
+        layer colors from bottom to top (0 brown, 1 yellow, 2 pink)
+    angle : float
+        rotation of the top tag in radians
+    """
+
+    def __init__(self, u, v, layers, angle=0.0):
+        self.u = u
+        self.v = v
+        self.layers = list(layers)
+        self.angle = angle
+
+    @property
+    def tagId(self):
+        return CAKE_TAGS[self.layers[-1]]
+
+    @property
+    def height(self):
+        return LAYER_HEIGHT * len(self.layers)
+
+    def groundTruth(self):
+        # Même format que CakeDetector.detectCakes : x = ligne, y = colonne
+        return dict(x=self.v, y=self.u, layers=list(reversed(self.layers)), hasCherry=False)
+
+
+def randomCakes(rng, nbCakes, minDistance=2.2 * CAKE_RADIUS):
+    """Tirer des gâteaux sans chevauchement sur la table"""
+    cakes = []
+    margin = 200
+    while len(cakes) < nbCakes:
+        u = rng.uniform(TABLE_U[0] + margin, TABLE_U[1] - margin)
+        v = rng.uniform(TABLE_V[0] + margin, TABLE_V[1] - margin)
+        if any(np.hypot(u - c.u, v - c.v) < minDistance for c in cakes):
+            continue
+        layers = list(rng.choice(3, size=rng.integers(1, 4), replace=False))
+        cakes.append(Cake(u, v, [int(l) for l in layers], rng.uniform(-np.pi, np.pi)))
+    return cakes
+
+
+class TableRenderer:
+    """
+    Render synthetic camera frames of the table with cakes
+
+    Frames are BGR, like the ones the client gives to CakeDetector.
+
+    Attributes
+    ----------
+    camera : Camera
+        camera pose and intrinsics
+    noise : float
+        standard deviation of the gaussian pixel noise
+    blur : int
+        size of the gaussian blur kernel, 0 for none
+
+    Methods
+    -------
+    render(cakes, rng)
+        frame of the table with the given cakes
+    scene(nbCakes, seed)
+        random scene, return (frame, ground truth)
+    """
+
+    def __init__(self, camera=None, noise=4.0, blur=3, poseNoise=0.0):
+        self.camera = camera if camera is not None else Camera()
+        self.noise = noise
+        self.blur = blur
+        self.poseNoise = poseNoise
+        self._table = self._tableTexture()
+        self._markers = {}
+
+    def _tableTexture(self):
+        texture = np.zeros((WARP_SIZE[1], WARP_SIZE[0], 3), np.uint8)
+        texture[:] = TABLE_COLOR[::-1]
+        texture[: TABLE_V[0], :] = 40
+        texture[TABLE_V[1] :, :] = 40
+        texture[:, : TABLE_U[0]] = 40
+        texture[:, TABLE_U[1] :] = 40
+        size = REFERENCE_TAG_SIZE
+        for tagId, (u, v) in REFERENCE_TAGS.items():
+            marker = markerImage(tagId, size)
+            pad = size // 6
+            texture[v - pad : v + size + pad, u - pad : u + size + pad] = marker[:, :, None]
+        return texture
+
+    def _marker(self, tagId):
+        if tagId not in self._markers:
+            self._markers[tagId] = cv2.cvtColor(markerImage(tagId, 96), cv2.COLOR_GRAY2BGR)
+        return self._markers[tagId]
+
+    def _paste(self, frame, image, corners):
+        """Coller image sur frame en envoyant ses coins sur corners"""
+        h, w = image.shape[:2]
+        x0, y0 = np.floor(corners.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(corners.max(axis=0)).astype(int) + 1
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, frame.shape[1]), min(y1, frame.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return
+        src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+        M = cv2.getPerspectiveTransform(src, np.float32(corners - (x0, y0)))
+        roi = (x1 - x0, y1 - y0)
+        warped = cv2.warpPerspective(image, M, roi, flags=cv2.INTER_LINEAR)
+        mask = cv2.warpPerspective(np.full((h, w), 255, np.uint8), M, roi) > 127
+        frame[y0:y1, x0:x1][mask] = warped[mask]
+
+    def _drawCake(self, frame, camera, cake):
+        circle = np.linspace(0, 2 * np.pi, 48, endpoint=False)
+        ring = np.stack([cake.u + CAKE_RADIUS * np.cos(circle), cake.v + CAKE_RADIUS * np.sin(circle)], axis=1)
+        for i, layer in enumerate(cake.layers):
+            z0, z1 = i * LAYER_HEIGHT, (i + 1) * LAYER_HEIGHT
+            points = np.concatenate(
+                [np.c_[ring, np.full(len(ring), z0)], np.c_[ring, np.full(len(ring), z1)]]
+            )
+            hull = cv2.convexHull(np.int32(np.round(camera.project(points))))
+            cv2.fillConvexPoly(frame, hull, LAYER_COLORS[layer][::-1], cv2.LINE_AA)
+        # Tag sur le dessus du gâteau
+        half = (CAKE_TAG_SIZE + 2 * (CAKE_TAG_SIZE / 6)) / 2
+        c, s = np.cos(cake.angle), np.sin(cake.angle)
+        square = np.array([[-half, -half], [half, -half], [half, half], [-half, half]])
+        square = square @ np.array([[c, s], [-s, c]]) + (cake.u, cake.v)
+        corners = camera.project(np.c_[square, np.full(4, cake.height)])
+        self._paste(frame, self._marker(cake.tagId), corners)
+
+    def render(self, cakes, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        camera = self.camera
+        if self.poseNoise:
+            camera = camera.jittered(rng, self.poseNoise, self.poseNoise)
+        frame = cv2.warpPerspective(
+            self._table, camera.planeHomography(0), camera.resolution, borderValue=(40, 40, 40)
+        )
+        # Du plus loin au plus proche de la caméra
+        order = sorted(cakes, key=lambda k: -np.hypot(k.u - camera.position[0], k.v - camera.position[1]))
+        for cake in order:
+            self._drawCake(frame, camera, cake)
+        if self.blur:
+            frame = cv2.GaussianBlur(frame, (self.blur, self.blur), 0)
+        if self.noise:
+            noise = rng.normal(0, self.noise, frame.shape)
+            frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        return frame
+
+    def scene(self, nbCakes, seed=None):
+        rng = np.random.default_rng(seed)
+        cakes = randomCakes(rng, nbCakes)
+        return self.render(cakes, rng), [cake.groundTruth() for cake in cakes]